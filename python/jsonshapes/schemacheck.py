@@ -2,124 +2,258 @@
 
 import sys
 import re
-import traceback
+import ast
+import threading
 import types
 import operator
 
 class InvalidDescriptor(Exception): pass
 
-class AbsentValue:
-    def __init__(self, name):
-        self.name = name
-    def __eq__(self, other):
-        return is_absent(other)
-    def __str__(self):
-        return repr(self)
-    def __repr__(self):
-        return 'AbsentValue(%s)' % (self.name,)
+# Sentinel standing in for a missing dictionary member. Comparing with
+# 'is' beats an isinstance check, and one shared sentinel beats one
+# allocation per missing key.
+_absent = object()
 
 def is_absent(v):
-    return isinstance(v, AbsentValue)
+    return v is _absent
+
+# Hoisted so type checks cost one C-level call with no per-call tuple.
+_string_types = str
+_number_types = (int, float)
+
+class Descriptor(object):
+    __slots__ = ()
 
-class Descriptor:
     def validate(self, v):
-        try:
-            return self._validate(v)
-        except:
-            (t, v, tb) = sys.exc_info()
-            err = '\n'.join(traceback.format_exception(t, v, tb))
-            return "Predicate failed: " + err
+        return self._validate(v)
 
     def _validate(self, v):
         raise NotImplementedError("Subclass responsibility")
 
+    def _validate_bool(self, v):
+        # Pass/fail only, without building the error structure.
+        # Subclasses with element loops override this to short-circuit.
+        try:
+            return not self._validate(v)
+        except:
+            return False
+
+# Prefer a linear-time (DFA-based) engine when available: it bounds
+# worst-case matching time on untrusted input, where the stdlib's
+# backtracking matcher can be pathological.
+try:
+    import re2 as _re_engine
+except ImportError:
+    _re_engine = re
+
+# Optional: batch-checks large homogeneous arrays at C speed.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_compiled_patterns = {}
+
+def compile_pattern(pat):
+    r = _compiled_patterns.get(pat)
+    if r is None:
+        try:
+            r = _re_engine.compile(pat)
+        except Exception:
+            # pattern uses features the alternate engine rejects
+            r = re.compile(pat)
+        r = _compiled_patterns.setdefault(pat, r)
+    return r
+
 class RegexpDescriptor(Descriptor):
+    __slots__ = ('pat', 'r')
     def __init__(self, pat):
         self.pat = pat
-        self.r = re.compile(pat)
+        self.r = compile_pattern(pat)
     def _validate(self, v):
+        if not isinstance(v, _string_types):
+            return "Expected string"
         return False if self.r.match(v) else "regexp failed: " + self.pat
 
 class NumberDescriptor(Descriptor):
+    __slots__ = ()
     def _validate(self, v):
-        return False if isinstance(v, int) or isinstance(v, float) else "Expected number"
+        return False if isinstance(v, _number_types) else "Expected number"
 
 class StringDescriptor(Descriptor):
+    __slots__ = ()
     def _validate(self, v):
-        return False if isinstance(v, str) or isinstance(v, unicode) else "Expected string"
+        return False if isinstance(v, _string_types) else "Expected string"
 
 class BooleanDescriptor(Descriptor):
+    __slots__ = ()
     def _validate(self, v):
         return False if isinstance(v, bool) else "Expected boolean"
 
 class NonemptyStringDescriptor(StringDescriptor):
+    __slots__ = ()
     def _validate(self, v):
         return StringDescriptor._validate(self, v) or \
                (False if len(v) > 0 else "Expected non-empty string")
 
-class ExactLiteralValueValidatorMixin:
+def literal_mismatch(v, literal):
+    if type(v) != type(literal):
+        return "Type mismatch: expected " + str(type(literal))
+    else:
+        return "Value mismatch: expected " + repr(literal)
+
+class ExactLiteralValueValidatorMixin(object):
+    __slots__ = ('literal',)
     def __init__(self, literal):
         self.literal = literal
     def _validate(self, v):
         if v == self.literal:
             return False
+        return literal_mismatch(v, self.literal)
 
-        if type(v) != type(self.literal):
-            return "Type mismatch: expected " + str(type(self.literal))
-        else:
-            return "Value mismatch: expected " + repr(self.literal)
-
-class ExactStringDescriptor(ExactLiteralValueValidatorMixin, StringDescriptor): pass
-class ExactNumberDescriptor(ExactLiteralValueValidatorMixin, NumberDescriptor): pass
-class ExactBooleanDescriptor(ExactLiteralValueValidatorMixin, BooleanDescriptor): pass
+class ExactStringDescriptor(ExactLiteralValueValidatorMixin, StringDescriptor): __slots__ = ()
+class ExactNumberDescriptor(ExactLiteralValueValidatorMixin, NumberDescriptor): __slots__ = ()
+class ExactBooleanDescriptor(ExactLiteralValueValidatorMixin, BooleanDescriptor): __slots__ = ()
 
 class ExactNullDescriptor(Descriptor):
+    __slots__ = ()
     def _validate(self, v):
         return False if v is None else "Expected null"
 
 class WildDescriptor(Descriptor):
+    __slots__ = ()
     def _validate(self, v):
         return False
 
 class NegationDescriptor(Descriptor):
+    __slots__ = ('t',)
     def __init__(self, t):
         self.t = expand(t)
     def _validate(self, v):
-        return False if self.t.validate(v) else "Negation failed"
+        return "Negation failed" if self.t._validate_bool(v) else False
+    def _validate_bool(self, v):
+        return not self.t._validate_bool(v)
 
 class MapDescriptor(Descriptor):
+    # _validate is an instance slot, bound in __init__ to the variant
+    # matching this descriptor: dictionary(anything, T) is common, and
+    # the wildcard side of each entry can be skipped wholesale.
+    __slots__ = ('keyType', 'valueType', '_check_keys', '_check_vals', '_validate')
     def __init__(self, keyType, valueType):
         self.keyType = expand(keyType)
         self.valueType = expand(valueType)
-    def _validate(self, v):
+        self._check_keys = not isinstance(self.keyType, WildDescriptor)
+        self._check_vals = not isinstance(self.valueType, WildDescriptor)
+        if self._check_keys:
+            self._validate = self._validate_both if self._check_vals else self._validate_keys
+        else:
+            self._validate = self._validate_values if self._check_vals else self._validate_none
+    def _validate_both(self, v):
+        if not isinstance(v, dict):
+            return "Type mismatch: expected dict"
+        checkKey = self.keyType._validate
+        checkVal = self.valueType._validate
         haveResult = False
         result = {}
-        for (key, val) in v.iteritems():
-            intermediate = self.keyType.validate(key)
+        for (key, val) in v.items():
+            intermediate = checkKey(key)
             if intermediate:
                 result["key " + str(key)] = intermediate
                 haveResult = True
             else:
-                intermediate = self.valueType.validate(val)
+                intermediate = checkVal(val)
                 if intermediate:
                     result["valueAt " + str(key)] = intermediate
                     haveResult = True
         return result if haveResult else False
+    def _validate_keys(self, v):
+        if not isinstance(v, dict):
+            return "Type mismatch: expected dict"
+        checkKey = self.keyType._validate
+        haveResult = False
+        result = {}
+        for key in v.keys():
+            intermediate = checkKey(key)
+            if intermediate:
+                result["key " + str(key)] = intermediate
+                haveResult = True
+        return result if haveResult else False
+    def _validate_values(self, v):
+        if not isinstance(v, dict):
+            return "Type mismatch: expected dict"
+        checkVal = self.valueType._validate
+        haveResult = False
+        result = {}
+        for (key, val) in v.items():
+            intermediate = checkVal(val)
+            if intermediate:
+                result["valueAt " + str(key)] = intermediate
+                haveResult = True
+        return result if haveResult else False
+    def _validate_none(self, v):
+        if not isinstance(v, dict):
+            return "Type mismatch: expected dict"
+        return False
+    def _validate_bool(self, v):
+        checkKeys = self._check_keys
+        checkVals = self._check_vals
+        if not (checkKeys or checkVals):
+            return isinstance(v, dict)
+        probeKey = self.keyType._validate_bool
+        probeVal = self.valueType._validate_bool
+        try:
+            for (key, val) in v.items():
+                if checkKeys and not probeKey(key): return False
+                if checkVals and not probeVal(val): return False
+            return True
+        except:
+            return False
 
 class ArrayDescriptor(Descriptor):
+    __slots__ = ('elementType', '_batch_numeric')
     def __init__(self, elementType):
         self.elementType = expand(elementType)
+        # exact type only: subclasses add checks the batch path can't see
+        self._batch_numeric = numpy is not None and type(self.elementType) is NumberDescriptor
+    def _all_numbers(self, v):
+        # True when numpy can vouch for every element in one C-level
+        # pass; False means undecided, fall back to the element loop.
+        if not (self._batch_numeric and isinstance(v, list) and len(v) >= 64):
+            return False
+        try:
+            arr = numpy.asarray(v)
+        except Exception:
+            return False
+        # A nested list of equal-length numeric lists coerces to a 2-D
+        # numeric array; only a flat 1-D array vouches for the elements
+        # themselves being numbers.
+        return arr.ndim == 1 and arr.dtype.kind in 'if'
     def _validate(self, v):
+        if not isinstance(v, list):
+            return "Type mismatch: expected list"
+        if self._all_numbers(v):
+            return False
+        check = self.elementType._validate
         haveResult = False
         result = {}
-        counter = 0
-        for val in v:
-            intermediate = self.elementType.validate(val)
+        for (counter, val) in enumerate(v):
+            intermediate = check(val)
             if intermediate:
                 result[counter] = intermediate
                 haveResult = True
-            counter = counter + 1
         return result if haveResult else False
+    def _validate_bool(self, v):
+        if not isinstance(v, list):
+            return False
+        if self._all_numbers(v):
+            return True
+        probe = self.elementType._validate_bool
+        try:
+            for val in v:
+                if not probe(val): return False
+            return True
+        except:
+            return False
 
 def merge_dicts(*pieces):
     result = {}
@@ -131,121 +265,503 @@ def merge_dicts(*pieces):
     return result
 
 class OptionalDescriptor(Descriptor):
+    __slots__ = ('t',)
     def __init__(self, t):
         self.t = expand(t)
     def _validate(self, v):
-        return False if is_absent(v) else self.t.validate(v)
+        return False if v is _absent else self.t._validate(v)
+    def _validate_bool(self, v):
+        return v is _absent or self.t._validate_bool(v)
+
+_email_pattern = r"^\S+@[^.\s]\S*\.[^.\s]{2,}$"
+_email_re = compile_pattern(_email_pattern)
 
 class EmailDescriptor(RegexpDescriptor):
+    __slots__ = ()
+    # TODO: better error message
     def __init__(self):
-        # TODO: better error message
-        RegexpDescriptor.__init__(self, r"^\S+@[^.\s]\S*\.[^.\s]{2,}$")
+        self.pat = _email_pattern
+        self.r = _email_re
+
+# _and/_or combinators commonly probe the same subvalue against the
+# same subschema more than once (overlapping alternatives, merged
+# dicts). Identity-keyed memoization of those probes is only sound
+# while the input value is guaranteed alive, so the table is active
+# strictly within one safe_validate call and cleared on the way out.
+# The state is per-thread: a concurrent validation on another thread
+# must neither share the table nor extend its lifetime.
+_memo_state = threading.local()
+_memo_missing = object()
+
+def _memo_validate_bool(t, v):
+    table = getattr(_memo_state, 'table', None)
+    if table is None:
+        return t._validate_bool(v)
+    key = (id(v), id(t))
+    cached = table.get(key, _memo_missing)
+    if cached is not _memo_missing:
+        return cached
+    result = t._validate_bool(v)
+    table[key] = result
+    return result
+
+def _hit_count(pair):
+    return pair[0]
 
 class GeneralAlternationDescriptor(Descriptor):
+    __slots__ = ('options', '_optionlist', '_calls')
     def __init__(self, options):
         self.options = expand_dict(options)
+        # [hits, descriptor] pairs, cheapest options probed first to
+        # start with; observed hit counts adapt the order at runtime
+        self._optionlist = [[0, valType]
+                            for valType in sorted(self.options.values(),
+                                                  key=static_cost)]
+        self._calls = 0
+    def _reorder(self):
+        # Rebind rather than sort in place: list.sort empties the list
+        # while the key function runs, so a concurrent validator could
+        # see no options at all. The rebind is atomic and readers keep
+        # iterating their old snapshot.
+        self._optionlist = sorted(self._optionlist, key=_hit_count, reverse=True)
     def _validate(self, v):
-        result = {}
-        for (key, valType) in self.options.iteritems():
-            intermediate = valType.validate(v)
-            if not intermediate: return False
-            result[key] = intermediate
-        return result
+        self._calls = self._calls + 1
+        if self._calls % 1024 == 0:
+            self._reorder()
+        for pair in self._optionlist:
+            if _memo_validate_bool(pair[1], v):
+                pair[0] = pair[0] + 1
+                return False
+        # nothing matched; run again collecting the per-option errors
+        return dict((key, valType._validate(v))
+                    for (key, valType) in self.options.items())
+    def _validate_bool(self, v):
+        for pair in self._optionlist:
+            if _memo_validate_bool(pair[1], v):
+                pair[0] = pair[0] + 1
+                return True
+        return False
 
 class NamedAlternationDescriptor(GeneralAlternationDescriptor):
+    __slots__ = ()
     def __init__(self, options):
         if not (isinstance(options, dict) and options):
             raise InvalidDescriptor("or_dict with non-dictionary or no options")
         GeneralAlternationDescriptor.__init__(self, options)
 
 class PositionalAlternationDescriptor(GeneralAlternationDescriptor):
+    __slots__ = ()
     def __init__(self, *optionlist):
         if not optionlist:
             raise InvalidDescriptor("_or with no options")
         GeneralAlternationDescriptor.__init__(self, dict(zip(range(len(optionlist)), optionlist)))
 
 class AndDescriptor(Descriptor):
+    __slots__ = ('schemas', '_ordered')
     def __init__(self, *schemas):
         self.schemas = expand_list(schemas)
+        # cheap checks first: any failure ends the conjunction
+        self._ordered = sorted(self.schemas, key=static_cost)
     def _validate(self, v):
-        for t in self.schemas:
-            intermediate = t.validate(v)
-            if intermediate: return intermediate
+        for t in self._ordered:
+            if not _memo_validate_bool(t, v):
+                # rare failure path: rerun to collect the error
+                return t._validate(v)
         return False
+    def _validate_bool(self, v):
+        for t in self._ordered:
+            if not _memo_validate_bool(t, v): return False
+        return True
+
+def compile_dict_validator(fields):
+    # Synthesizes a straight-line checker for a dict descriptor's
+    # fields: key names become constants in the generated code and the
+    # field validators are pre-resolved, so validating an object runs
+    # one flat function instead of a loop of dynamic lookups.
+    # Literal-valued fields skip descriptor dispatch entirely and
+    # compare inline; only a mismatch calls back into Python.
+    env = {'_absent': _absent, '_literal_mismatch': literal_mismatch}
+    lines = ['def _check_fields(v):']
+    lines.append('    if not isinstance(v, dict):')
+    lines.append('        return "Type mismatch: expected dict"')
+    lines.append('    result = {}')
+    for (i, (key, valType)) in enumerate(fields.items()):
+        keyName = '_key%d' % (i,)
+        env[keyName] = key
+        if isinstance(valType, ExactLiteralValueValidatorMixin):
+            literalName = '_literal%d' % (i,)
+            env[literalName] = valType.literal
+            lines.append('    value = v.get(%s, _absent)' % (keyName,))
+            lines.append('    if value != %s:' % (literalName,))
+            lines.append('        result[%s] = _literal_mismatch(value, %s)' % (keyName, literalName))
+        else:
+            checkName = '_check%d' % (i,)
+            env[checkName] = valType._validate
+            lines.append('    intermediate = %s(v.get(%s, _absent))' % (checkName, keyName))
+            lines.append('    if intermediate:')
+            lines.append('        result[%s] = intermediate' % (keyName,))
+    lines.append('    return result or False')
+    tree = ast.parse('\n'.join(lines), '<schema>', 'exec')
+    code = compile(ast.fix_missing_locations(tree), '<schema>', 'exec')
+    exec(code, env)
+    return env['_check_fields']
 
 class ExtensibleDictDescriptor(Descriptor):
+    __slots__ = ('t', '_known_keys', '_literal_fields', '_complex_fields', '_compiled')
     def __init__(self, t):
         self.t = expand_dict(t)
+        self._known_keys = frozenset(self.t)
+        self._literal_fields = dict((key, valType.literal)
+                                    for (key, valType) in self.t.items()
+                                    if isinstance(valType, ExactLiteralValueValidatorMixin))
+        self._complex_fields = dict((key, valType)
+                                    for (key, valType) in self.t.items()
+                                    if not isinstance(valType, ExactLiteralValueValidatorMixin))
+        self._compiled = compile_dict_validator(self.t)
     def _validate(self, v):
-        haveResult = False
-        result = {}
-        for (key, valType) in self.t.iteritems():
-            intermediate = valType.validate(v.get(key, AbsentValue(key)))
-            if intermediate:
-                haveResult = True
-                result[key] = intermediate
-        return result if haveResult else False
+        return self._compiled(v)
+    def _validate_bool(self, v):
+        # Guard explicitly: a field-less extensible dict has nothing to
+        # probe, so the loops alone would accept any value at all.
+        if not isinstance(v, dict):
+            return False
+        try:
+            for (key, literal) in self._literal_fields.items():
+                if v.get(key, _absent) != literal: return False
+            for (key, valType) in self._complex_fields.items():
+                if not valType._validate_bool(v.get(key, _absent)): return False
+            return True
+        except:
+            return False
     def as_dict(self):
         result = dict(self.t)
         result["_extensible"] = True
         return result
 
 class ExactDictDescriptor(ExtensibleDictDescriptor):
+    __slots__ = ()
     def _validate(self, v):
-        extraKeys = set(v) - set(self.t)
+        if not isinstance(v, dict):
+            return "Type mismatch: expected dict"
+        extraKeys = v.keys() - self._known_keys
         if extraKeys: return "Unexpected properties: " + (', '.join(extraKeys))
         return ExtensibleDictDescriptor._validate(self, v)
+    def _validate_bool(self, v):
+        try:
+            if v.keys() - self._known_keys: return False
+        except:
+            return False
+        return ExtensibleDictDescriptor._validate_bool(self, v)
     def as_dict(self):
         return self.t
 
 class ListDescriptor(Descriptor):
+    __slots__ = ('t', '_len')
     def __init__(self, t):
         self.t = expand_list(t)
+        self._len = len(self.t)
     def _validate(self, v):
-        if len(v) != len(self.t):
-            return "Length mismatch: expected array of length " + str(len(self.t))
+        if not isinstance(v, list):
+            return "Type mismatch: expected list"
+        if len(v) != self._len:
+            return "Length mismatch: expected array of length " + str(self._len)
         haveResult = False
         result = {}
-        for i in range(len(self.t)):
-            intermediate = self.t[i].validate(v[i])
+        for (i, (valType, val)) in enumerate(zip(self.t, v)):
+            intermediate = valType._validate(val)
             if intermediate:
                 haveResult = True
                 result[str(i)] = intermediate
         return result if haveResult else False
+    def _validate_bool(self, v):
+        try:
+            if not isinstance(v, list): return False
+            if len(v) != self._len: return False
+            for (valType, val) in zip(self.t, v):
+                if not valType._validate_bool(val): return False
+            return True
+        except:
+            return False
+
+def static_cost(t):
+    # Rough relative price of running t's validator once, used to probe
+    # cheap alternatives before expensive ones.
+    if isinstance(t, RegexpDescriptor):
+        return 5
+    if isinstance(t, (NegationDescriptor, OptionalDescriptor)):
+        return 1 + static_cost(t.t)
+    if isinstance(t, MapDescriptor):
+        return 10 + static_cost(t.keyType) + static_cost(t.valueType)
+    if isinstance(t, ArrayDescriptor):
+        return 10 + static_cost(t.elementType)
+    if isinstance(t, ExtensibleDictDescriptor):
+        return 10 + sum(static_cost(x) for x in t.t.values())
+    if isinstance(t, ListDescriptor):
+        return 10 + sum(static_cost(x) for x in t.t)
+    if isinstance(t, AndDescriptor):
+        return 1 + sum(static_cost(x) for x in t.schemas)
+    if isinstance(t, GeneralAlternationDescriptor):
+        return 1 + sum(static_cost(x) for x in t.options.values())
+    return 1
 
 def expand_dict(d):
-    return dict((k, expand(v)) for (k, v) in d.iteritems())
+    # Interned keys make the v.get(key, ...) lookups during validation
+    # hit the pointer-equality fast path.
+    return dict((sys.intern(k) if type(k) is str else k, expand(v))
+                for (k, v) in d.items())
 
 def expand_list(xs):
     return [expand(x) for x in xs]
 
+_expanded_schemas = {}
+_interned_descriptors = {}
+
+def _intern_entry_order(entry):
+    # Sort key for dict entries that tolerates mixed key types, which
+    # Python 3 refuses to order directly.
+    k = entry[0]
+    return (type(k).__name__, repr(k))
+
+def _intern_key(t):
+    # Canonical hashable form of a proto-schema, so structurally equal
+    # subschemas share one expanded Descriptor. Embedded Descriptor
+    # instances compare by identity; the type name keeps literals such
+    # as 1, 1.0 and True distinct despite comparing equal.
+    if isinstance(t, Descriptor):
+        return ('descriptor', id(t))
+    if isinstance(t, dict):
+        return ('dict', tuple(sorted(((k, _intern_key(x)) for (k, x) in t.items()),
+                                     key=_intern_entry_order)))
+    if isinstance(t, list):
+        return ('list', tuple(_intern_key(x) for x in t))
+    return ('literal', type(t).__name__, t)
+
+def _intern_literal(descriptorClass, t):
+    key = ('literal', type(t).__name__, t)
+    d = _interned_descriptors.get(key)
+    if d is None:
+        d = _interned_descriptors.setdefault(key, descriptorClass(t))
+    return d
+
+def _expand_dict(t):
+    # Shared subschemas expand to one shared Descriptor. As with
+    # _compiled_schemas, the cache entry pins t so its id stays valid.
+    cached = _expanded_schemas.get(id(t))
+    if cached is not None and cached[0] is t:
+        return cached[1]
+    key = _intern_key(t)
+    d = _interned_descriptors.get(key)
+    if d is None:
+        copy = dict(t) # make a copy, as we'll be altering it
+        if copy.pop("_extensible", False):
+            d = ExtensibleDictDescriptor(copy)
+        else:
+            d = ExactDictDescriptor(copy)
+        d = _interned_descriptors.setdefault(key, d)
+    _expanded_schemas[id(t)] = (t, d)
+    return d
+
+def _expand_list(t):
+    cached = _expanded_schemas.get(id(t))
+    if cached is not None and cached[0] is t:
+        return cached[1]
+    key = _intern_key(t)
+    d = _interned_descriptors.get(key)
+    if d is None:
+        d = _interned_descriptors.setdefault(key, ListDescriptor(t))
+    _expanded_schemas[id(t)] = (t, d)
+    return d
+
+def _expand_string(t):
+    return _intern_literal(ExactStringDescriptor, t)
+
+def _expand_number(t):
+    return _intern_literal(ExactNumberDescriptor, t)
+
+def _expand_bool(t):
+    return _intern_literal(ExactBooleanDescriptor, t)
+
+_null_descriptor = ExactNullDescriptor()
+
+def _expand_null(t):
+    return _null_descriptor
+
+def _expand_other(t):
+    # Subclasses of the builtin types miss the exact-type table; fall
+    # back to isinstance dispatch for them.
+    if isinstance(t, dict):
+        return _expand_dict(t)
+    if isinstance(t, list):
+        return _expand_list(t)
+    if isinstance(t, _string_types):
+        return _expand_string(t)
+    if isinstance(t, bool):
+        return _expand_bool(t)
+    if isinstance(t, _number_types):
+        return _expand_number(t)
+    raise InvalidDescriptor("Invalid proto-descriptor passed to expand", t)
+
+_expanders = {
+    dict: _expand_dict,
+    list: _expand_list,
+    str: _expand_string,
+    int: _expand_number,
+    float: _expand_number,
+    bool: _expand_bool,
+    type(None): _expand_null,
+}
+
 def expand(t):
     if isinstance(t, Descriptor):
         return t
+    handler = _expanders.get(type(t))
+    if handler is None:
+        return _expand_other(t)
+    return handler(t)
 
-    if isinstance(t, dict):
-        t = dict(t) # make a copy, as we'll be altering it
-        if t.pop("_extensible", False):
-            return ExtensibleDictDescriptor(t)
-        else:
-            return ExactDictDescriptor(t)
+class SchemaCompiler(object):
+    __slots__ = ('counter', 'lines', 'env')
 
-    if isinstance(t, list):
-        return ListDescriptor(t)
+    # Translates a proto-descriptor into the source code of a single
+    # function, so that validating an input runs straight-line checks
+    # instead of re-walking the schema tree on every call.
+    def __init__(self):
+        self.counter = 0
+        self.lines = []
+        self.env = {'_absent': _absent}
 
-    if isinstance(t, str) or isinstance(t, unicode):
-        return ExactStringDescriptor(t) # TODO: coerce to unicode maybe?
+    def gensym(self, prefix):
+        self.counter = self.counter + 1
+        return '_%s%d' % (prefix, self.counter)
 
-    if isinstance(t, int) or isinstance(t, float):
-        return ExactNumberDescriptor(t)
+    def bind(self, prefix, value):
+        name = self.gensym(prefix)
+        self.env[name] = value
+        return name
 
-    if isinstance(t, bool):
-        return ExactBooleanDescriptor(t)
+    def emit(self, line):
+        self.lines.append(line)
 
-    if t is None:
-        return ExactNullDescriptor()
+    def compile(self, t):
+        if isinstance(t, Descriptor):
+            return self.bind('check', t._validate)
 
-    raise InvalidDescriptor("Invalid proto-descriptor passed to expand", t)
+        if isinstance(t, dict):
+            return self.compile_dict(t)
+
+        if isinstance(t, list):
+            return self.compile_list(t)
+
+        if isinstance(t, _string_types) or isinstance(t, _number_types) or t is None:
+            return self.compile_literal(t)
+
+        raise InvalidDescriptor("Invalid proto-descriptor passed to compile", t)
+
+    def compile_dict(self, t):
+        t = dict(t) # make a copy, as we'll be altering it
+        extensible = t.pop("_extensible", False)
+        checks = [(key, self.compile(valType)) for (key, valType) in t.items()]
+        name = self.gensym('schema')
+        self.emit('def %s(v):' % (name,))
+        self.emit('    if not isinstance(v, dict):')
+        self.emit('        return "Type mismatch: expected dict"')
+        if not extensible:
+            knownKeys = self.bind('keys', frozenset(t))
+            self.emit('    extraKeys = set(v) - %s' % (knownKeys,))
+            self.emit('    if extraKeys:')
+            self.emit('        return "Unexpected properties: " + (", ".join(extraKeys))')
+        self.emit('    result = {}')
+        for (key, check) in checks:
+            keyName = self.bind('key', key)
+            self.emit('    intermediate = %s(v.get(%s, _absent))' % (check, keyName))
+            self.emit('    if intermediate:')
+            self.emit('        result[%s] = intermediate' % (keyName,))
+        self.emit('    return result or False')
+        return name
+
+    def compile_list(self, t):
+        checks = [self.compile(x) for x in t]
+        if len(t) >= 16:
+            checksName = self.gensym('checks')
+            self.emit('%s = [%s]' % (checksName, ', '.join(checks)))
+        name = self.gensym('schema')
+        self.emit('def %s(v):' % (name,))
+        self.emit('    if not isinstance(v, list):')
+        self.emit('        return "Type mismatch: expected list"')
+        self.emit('    if len(v) != %d:' % (len(t),))
+        self.emit('        return "Length mismatch: expected array of length %d"' % (len(t),))
+        self.emit('    result = {}')
+        if len(t) < 16:
+            # short lists get an unrolled check per position
+            for (i, check) in enumerate(checks):
+                self.emit('    intermediate = %s(v[%d])' % (check, i))
+                self.emit('    if intermediate:')
+                self.emit("        result['%d'] = intermediate" % (i,))
+        else:
+            self.emit('    for i in range(%d):' % (len(t),))
+            self.emit('        intermediate = %s[i](v[i])' % (checksName,))
+            self.emit('        if intermediate:')
+            self.emit('            result[str(i)] = intermediate')
+        self.emit('    return result or False')
+        return name
+
+    def compile_literal(self, t):
+        name = self.gensym('schema')
+        self.emit('def %s(v):' % (name,))
+        if t is None:
+            self.emit('    return False if v is None else "Expected null"')
+            return name
+        literal = self.bind('literal', t)
+        self.emit('    if v == %s:' % (literal,))
+        self.emit('        return False')
+        self.emit('    if type(v) != type(%s):' % (literal,))
+        self.emit('        return "Type mismatch: expected " + str(type(%s))' % (literal,))
+        self.emit('    return "Value mismatch: expected " + repr(%s)' % (literal,))
+        return name
+
+def compile_schema(t):
+    compiler = SchemaCompiler()
+    root = compiler.compile(t)
+    source = '\n'.join(compiler.lines) or 'pass'
+    ns = dict(compiler.env)
+    exec(source, ns)
+    return ns[root]
+
+_compiled_schemas = {}
+
+def compiled_validator(t):
+    # We key on id(t) but keep t alive in the cache entry, so a dead
+    # schema's id can never be recycled out from under us.
+    cached = _compiled_schemas.get(id(t))
+    if cached is not None and cached[0] is t:
+        return cached[1]
+    f = compile_schema(t)
+    _compiled_schemas[id(t)] = (t, f)
+    return f
+
+def validate(v, t):
+    if isinstance(t, Descriptor):
+        return t._validate(v)
+    return compiled_validator(t)(v)
+
+def safe_validate(v, t):
+    # Guarded top-level entry point. Descriptor.validate used to catch
+    # and format exceptions at every node, which made every call pay
+    # for the handler frame; now only the outermost call does, and the
+    # report is a one-line summary rather than a full traceback.
+    # Also brackets the combinator memo table's lifetime: see
+    # _memo_validate_bool.
+    toplevel = getattr(_memo_state, 'table', None) is None
+    if toplevel:
+        _memo_state.table = {}
+    try:
+        return validate(v, t)
+    except:
+        (exceptionType, exceptionValue) = sys.exc_info()[:2]
+        return "Predicate failed: %s: %s" % (exceptionType.__name__, exceptionValue)
+    finally:
+        if toplevel:
+            _memo_state.table = None
 
 global_environment = {
     'regexp': RegexpDescriptor,
@@ -268,11 +784,11 @@ global_environment = {
 }
 
 def load_schema(filename, extendingEnvironment = None):
-    f = file(filename)
+    f = open(filename)
     sourcetext = f.read()
     f.close()
     results = dict(extendingEnvironment or {})
-    exec sourcetext in global_environment, results
+    exec(sourcetext, global_environment, results)
     for key in results:
         results[key] = expand(results[key])
     return results
@@ -291,9 +807,9 @@ if __name__ == '__main__':
         import simplejson as json
 
     v = json.loads(sys.stdin.read())
-    result = t.validate(v)
+    result = safe_validate(v, t)
     if result:
-        print json.dumps(result)
+        print(json.dumps(result))
         sys.exit(1)
     else:
         sys.exit(0)